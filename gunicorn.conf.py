@@ -0,0 +1,21 @@
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5002')}"
+workers = multiprocessing.cpu_count() * 2 + 1
+worker_class = 'gthread'
+threads = 8
+
+# Import the app once in the master so workers fork-share the loaded modules and clients
+preload_app = True
+
+# Background threads (scheduler, log writer, rate limiter) started in the master would
+# not exist in the forked workers, so each worker starts its own after fork.
+os.environ['DEFER_BACKGROUND_WORKERS'] = '1'
+
+
+def post_fork(server, worker):
+    import main
+    # Keep the shared object graph but give each worker its own Supabase sockets
+    main.supabase = main.create_supabase_client()
+    main.start_background_workers()
@@ -1,42 +1,146 @@
 import os
 import threading
+import queue
+import atexit
 import time
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, Response
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from flask import Flask, request, Response, stream_with_context
+from flask_compress import Compress
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.executors.pool import ThreadPoolExecutor as SchedulerThreadPoolExecutor
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from twilio.rest import Client as TwilioClient
+from twilio.http.http_client import TwilioHttpClient
 from twilio.twiml.messaging_response import MessagingResponse
 import logging
-import schedule
+from logging.handlers import QueueHandler, QueueListener
 import google.generativeai as genai
 import uuid
+import hashlib
+from enum import Enum
+from collections import namedtuple
+from itertools import groupby
+from operator import itemgetter
 import re
 import pytz
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+import psycopg2
+from cachetools import TTLCache
+import redis
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Configure logging. Records are put on a queue by the calling thread and formatted
+# and written by a background listener, keeping log I/O off the request path. Until
+# the listener runs (after fork when gunicorn preloads the app) records are written
+# directly, so nothing is left queued in the master to be copied into every worker.
+log_queue = queue.Queue(-1)
+log_output_handler = logging.StreamHandler()
+log_output_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+log_queue_handler = QueueHandler(log_queue)
+# The output handler applies the real format; the queue side only merges args into the message
+log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[log_output_handler])
 logger = logging.getLogger(__name__)
+_log_listener = None
+_log_listener_pid = None
+
+def start_log_listener():
+    # Also called after fork, since the listener thread does not survive it
+    global _log_listener, _log_listener_pid
+    if _log_listener_pid == os.getpid():
+        return
+    _log_listener_pid = os.getpid()
+    _log_listener = QueueListener(log_queue, log_output_handler, respect_handler_level=True)
+    _log_listener.start()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(log_queue_handler)
+    root_logger.removeHandler(log_output_handler)
+
+def stop_log_listener():
+    global _log_listener
+    if _log_listener and _log_listener_pid == os.getpid():
+        # Write directly again so records logged after this are not stranded on the queue
+        root_logger = logging.getLogger()
+        root_logger.addHandler(log_output_handler)
+        root_logger.removeHandler(log_queue_handler)
+        _log_listener.stop()
+        _log_listener = None
+
+# A preloading gunicorn master must not run threads; workers start theirs after fork
+if os.getenv('DEFER_BACKGROUND_WORKERS') != '1':
+    start_log_listener()
+atexit.register(stop_log_listener)
 
 app = Flask(__name__)
+# Compress JSON responses over 1 KB (notification lists compress very well)
+app.config.update(
+    COMPRESS_MIMETYPES=['application/json'],
+    COMPRESS_LEVEL=6,
+    COMPRESS_MIN_SIZE=1024,
+    COMPRESS_ALGORITHM=['br', 'gzip']
+)
+Compress(app)
 
 # Initialize Supabase client
 supabase_url = os.getenv('SUPABASE_URL')
 supabase_key = os.getenv('SUPABASE_KEY')
 if not supabase_url or not supabase_key:
     raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in the environment.")
-supabase: Client = create_client(supabase_url, supabase_key)
+
+def create_supabase_client():
+    client = create_client(supabase_url, supabase_key)
+    # Reuse one HTTP/2 keep-alive connection pool for all PostgREST calls instead of
+    # paying a TLS handshake on every poller query.
+    try:
+        postgrest_session = client.postgrest.session
+        client.postgrest.session = httpx.Client(
+            base_url=postgrest_session.base_url,
+            headers=postgrest_session.headers,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=300.0),
+            timeout=10.0
+        )
+        postgrest_session.close()
+        logger.info("Supabase PostgREST client configured with HTTP/2 connection pooling.")
+    except Exception as e:
+        logger.warning(f"Failed to configure HTTP/2 pooling for Supabase: {str(e)}. Using default client.")
+    return client
+
+# Created at import so gunicorn's preload_app builds it once in the master; each
+# worker swaps in its own after fork (see gunicorn.conf.py) so sockets are not shared.
+supabase: Client = create_supabase_client()
 
 # Initialize Twilio client
 account_sid = os.getenv('TWILIO_ACCOUNT_SID')
 auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-twilio_client = TwilioClient(account_sid, auth_token)
+# Shared keep-alive pool for Twilio API calls, sized above send_pool's worker count so
+# concurrent sends never discard connections. urllib3 does not retry POSTs by
+# default, so message creation is never sent twice.
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+))
+twilio_http_client = TwilioHttpClient(pool_connections=True)
+twilio_http_client.session = http_session
+twilio_client = TwilioClient(account_sid, auth_token, http_client=twilio_http_client)
 twilio_whatsapp_number = os.getenv('TWILIO_WHATSAPP_NUMBER')
 
+# Postgres connection string for the scheduler advisory lock. It must be a direct or
+# session-mode pooler connection: Supabase's transaction pooler (port 6543) hands each
+# statement to any backend, so a session-level advisory lock would not be held.
+database_url = os.getenv('DATABASE_URL')
+
 # Initialize Gemini
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 try:
@@ -47,50 +151,206 @@ except Exception as e:
     logger.error(f"Failed to configure Gemini API: {str(e)}. AI features will be unavailable.")
     gemini_model = None
 
-# Global dictionary to store conversation states
-conversations = {}
-conversations_lock = threading.Lock()
+# Initialize Redis (optional). When REDIS_URL is set, the notifications cache and the
+# reminder send-dedup keys are shared across all workers and hosts.
+REDIS_URL = os.getenv('REDIS_URL')
+redis_client = None
+if REDIS_URL:
+    try:
+        # Short timeouts so an unreachable Redis degrades to the fallbacks instead of
+        # hanging requests
+        redis_client = redis.Redis(
+            connection_pool=redis.BlockingConnectionPool.from_url(
+                REDIS_URL,
+                max_connections=64,
+                timeout=1,
+                socket_connect_timeout=1,
+                socket_timeout=1
+            )
+        )
+        logger.info("Redis configured successfully.")
+    except Exception as e:
+        logger.error(f"Failed to configure Redis: {str(e)}. Falling back to in-process caches.")
+        redis_client = None
 
-# Global set to track events being processed (prevents duplicates)
-processing_events = set()
-processing_lock = threading.Lock()
+# Gemini chat history lives in the Supabase 'conversations' table so any worker can
+# serve any user. Live chat sessions are kept per process as a fast path and record
+# the newest persisted idx they contain. They are rebuilt from the table when another
+# worker has saved newer turns, once they expire, or once they grow past
+# CHAT_SESSION_MAX_MESSAGES.
+CONVERSATION_HISTORY_LIMIT = 20
+CHAT_SESSION_MAX_MESSAGES = 40
+chat_sessions = TTLCache(maxsize=1000, ttl=600)
+chat_sessions_lock = threading.Lock()
 
 # --- NOTIFICATION LOGGING ---
-def log_notification_to_db(user_id, event_id, notification_type, notification_content, phone_number, twilio_message_sid=None, delivery_status='sent'):
+# Log rows are queued and written in batches by a background thread so senders
+# never wait on the Supabase insert.
+NOTIFICATION_LOG_BATCH_SIZE = 200
+NOTIFICATION_LOG_MAX_WAIT = 0.05
+notification_log_queue = queue.SimpleQueue()
+
+# Serialized /notifications/<user_id> responses, invalidated when new rows for
+# the user are written. When Redis is configured it is the only cache, so an
+# invalidation by any worker is seen by all of them; the in-process cache is
+# used only without Redis.
+NOTIFICATIONS_CACHE_TTL = 15
+notifications_cache = TTLCache(maxsize=2048, ttl=NOTIFICATIONS_CACHE_TTL)
+notifications_cache_lock = threading.RLock()
+
+def invalidate_notifications_cache(user_ids):
+    with notifications_cache_lock:
+        for user_id in user_ids:
+            notifications_cache.pop(user_id, None)
+    if redis_client and user_ids:
+        try:
+            redis_client.delete(*[f'nl:{user_id}' for user_id in user_ids])
+        except Exception as e:
+            logger.warning(f"Failed to invalidate shared notifications cache: {str(e)}")
+
+def get_shared_notifications(user_id):
+    if not redis_client:
+        return None
     try:
-        notification_data = {
-            'user_id': user_id,
-            'event_id': event_id,
-            'notification_type': notification_type,
-            'notification_content': notification_content,
-            'phone_number': phone_number,
-            'twilio_message_sid': twilio_message_sid,
-            'delivery_status': delivery_status,
-            'sent_at': datetime.now().isoformat()
-        }
-        response = supabase.table('notifications_sent').insert(notification_data).execute()
-        if response.data:
-            logger.info(f"Notification logged to database successfully. ID: {response.data[0]['id']}")
-            return response.data[0]['id']
-        else:
-            logger.warning("Failed to log notification to database - no data returned")
-            return None
+        return redis_client.get(f'nl:{user_id}')
     except Exception as e:
-        logger.error(f"Error logging notification to database: {str(e)}")
+        logger.warning(f"Failed to read shared notifications cache for user {user_id}: {str(e)}")
         return None
 
+def set_shared_notifications(user_id, body):
+    if not redis_client:
+        return
+    try:
+        redis_client.set(f'nl:{user_id}', body, ex=NOTIFICATIONS_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to write shared notifications cache for user {user_id}: {str(e)}")
+
+# Queued rows are kept as tuples and only turned into dicts for the insert
+NotificationLogRow = namedtuple(
+    'NotificationLogRow',
+    'user_id event_id notification_type notification_content phone_number twilio_message_sid delivery_status sent_at'
+)
+
+def log_notification_to_db(user_id, event_id, notification_type, notification_content, phone_number, twilio_message_sid=None, delivery_status='sent'):
+    notification_log_queue.put(NotificationLogRow(
+        user_id=user_id,
+        event_id=event_id,
+        notification_type=notification_type,
+        notification_content=notification_content,
+        phone_number=phone_number,
+        twilio_message_sid=twilio_message_sid,
+        delivery_status=delivery_status,
+        sent_at=datetime.now().isoformat()
+    ))
+
+def _drain_notification_log():
+    # Block for the first row, then collect more until the batch fills or the wait expires
+    items = [notification_log_queue.get()]
+    deadline = time.monotonic() + NOTIFICATION_LOG_MAX_WAIT
+    while len(items) < NOTIFICATION_LOG_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            items.append(notification_log_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return items
+
+def _write_notification_log(items):
+    try:
+        supabase.table('notifications_sent').insert([item._asdict() for item in items]).execute()
+        invalidate_notifications_cache({item.user_id for item in items})
+        logger.info(f"Logged {len(items)} notification(s) to database.")
+    except Exception as e:
+        logger.error(f"Error logging {len(items)} notification(s) to database: {str(e)}")
+
+def notification_log_writer():
+    while True:
+        _write_notification_log(_drain_notification_log())
+
+def flush_notification_log():
+    # Write whatever is still queued so rows are not lost on shutdown
+    items = []
+    while True:
+        try:
+            items.append(notification_log_queue.get_nowait())
+        except queue.Empty:
+            break
+    for start in range(0, len(items), NOTIFICATION_LOG_BATCH_SIZE):
+        _write_notification_log(items[start:start + NOTIFICATION_LOG_BATCH_SIZE])
+
+atexit.register(flush_notification_log)
+
+# --- TWILIO SEND POOL ---
+# Twilio accepts up to 25 text messages per second per sender; sends are I/O-bound,
+# so they run concurrently on a shared pool while a token bucket enforces the rate.
+TWILIO_MESSAGES_PER_SECOND = 25
+
+class RateLimiter:
+    def __init__(self, rate, per=1.0):
+        self._tokens = threading.BoundedSemaphore(rate)
+        self._refill_interval = per / rate
+
+    def start(self):
+        threading.Thread(target=self._refill, daemon=True, name='twilio-rate-limiter').start()
+
+    def _refill(self):
+        while True:
+            time.sleep(self._refill_interval)
+            try:
+                self._tokens.release()
+            except ValueError:
+                # Bucket is already full
+                pass
+
+    def acquire(self):
+        self._tokens.acquire()
+
+send_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix='twilio-send')
+twilio_rate_limiter = RateLimiter(rate=TWILIO_MESSAGES_PER_SECOND, per=1.0)
+
+def _send_one(to, body):
+    if not str(to).startswith('whatsapp:'):
+        to = f"whatsapp:{to}"
+    twilio_rate_limiter.acquire()
+    return twilio_client.messages.create(
+        body=body,
+        from_=twilio_whatsapp_number,
+        to=to
+    )
+
 # --- WHATSAPP SENDING ---
+SEND_DEDUP_TTL = 3600
+
+def claim_event_send(event_id, user_id):
+    # SETNX across all workers; without Redis the events claim UPDATE is the only guard
+    if not redis_client or not event_id:
+        return True
+    try:
+        return bool(redis_client.set(f'sent:{event_id}:{user_id}', 1, nx=True, ex=SEND_DEDUP_TTL))
+    except Exception as e:
+        logger.warning(f"Failed to check send dedup for event {event_id}: {str(e)}")
+        return True
+
+def release_event_send(event_id, user_id):
+    if not redis_client or not event_id:
+        return
+    try:
+        redis_client.delete(f'sent:{event_id}:{user_id}')
+    except Exception as e:
+        logger.warning(f"Failed to release send dedup for event {event_id}: {str(e)}")
+
 def send_whatsapp_notification(phone_number, message, user_id=None, event_id=None, notification_type='event_reminder'):
+    if not claim_event_send(event_id, user_id):
+        logger.info(f"WhatsApp message for event {event_id} to user {user_id} was already sent. Skipping.")
+        return True
     try:
         if not phone_number.startswith('+'):
             phone_number = '+' + phone_number
         whatsapp_number = f"whatsapp:{phone_number}"
         logger.info(f"Attempting to send WhatsApp message to {whatsapp_number}")
-        twilio_message = twilio_client.messages.create(
-            body=message,
-            from_=twilio_whatsapp_number,
-            to=whatsapp_number
-        )
+        twilio_message = _send_one(whatsapp_number, message)
         logger.info(f"WhatsApp message sent successfully to {phone_number}. SID: {twilio_message.sid}")
         if user_id:
             log_notification_to_db(
@@ -105,6 +365,7 @@ def send_whatsapp_notification(phone_number, message, user_id=None, event_id=Non
         return True
     except Exception as e:
         logger.error(f"Failed to send WhatsApp message to {phone_number}: {str(e)}")
+        release_event_send(event_id, user_id)
         if user_id:
             log_notification_to_db(
                 user_id=user_id,
@@ -117,7 +378,90 @@ def send_whatsapp_notification(phone_number, message, user_id=None, event_id=Non
             )
         return False
 
+# --- MESSAGE TEMPLATES ---
+_REMINDER_TMPL = (
+    "🔔 Event Reminder\n"
+    "\n"
+    "Hi {user_name}!\n"
+    "\n"
+    "You have an upcoming {event_type_text}:\n"
+    "📅 {title}\n"
+    "📆 Date: {event_date_formatted}\n"
+    "\n"
+    "Don't forget to prepare for this important event!\n"
+    "\n"
+    "Best regards,\n"
+    "RemindMe"
+)
+_TEST_NOTIFICATION_TMPL = (
+    "🔔 Test Notification\n"
+    "\n"
+    "Hi {name}!\n"
+    "\n"
+    "This is a test message from RemindMe to verify WhatsApp notifications are working correctly.\n"
+    "\n"
+    "If you received this message, your notifications are set up properly! 🎉"
+)
+_RSVP_INVITE_TMPL = "{title}\n{message}\n\nIf attending, respond by replying 'rsvp: yes'. If not, reply 'rsvp: no'."
+
 # --- SCHEDULER FOR NOTIFICATIONS ---
+def notify_event(execution_id, event, user_profile):
+    event_id = event['id']
+    # Atomic claim: only succeeds if no other run or worker has notified this event yet
+    claim_response = supabase.table('events').update({'notified': 'Yes'}) \
+        .eq('id', event_id) \
+        .or_('notified.is.null,notified.eq.') \
+        .execute()
+    if not claim_response.data:
+        logger.info(f"[{execution_id}] Event {event_id} has already been claimed by another run. Skipping.")
+        return None
+    logger.info(f"[{execution_id}] Event '{event['title']}' (ID: {event_id}) successfully marked 'Yes' for notification.")
+    if not user_profile or not user_profile.get('phone_number'):
+        logger.warning(f"[{execution_id}] No phone number found for user {event['user_id']} or profile incomplete.")
+        return False
+    message = _REMINDER_TMPL.format_map({
+        'user_name': user_profile.get('full_name', 'User'),
+        'event_type_text': "recurring event" if event['event_type'] == 'recurrence' else "deadline",
+        'title': event['title'],
+        'event_date_formatted': date.fromisoformat(event['event_date']).strftime('%B %d, %Y')
+    })
+    if send_whatsapp_notification(
+        phone_number=user_profile['phone_number'], 
+        message=message,
+        user_id=event['user_id'],
+        event_id=event_id,
+        notification_type='event_reminder'
+    ):
+        logger.info(f"[{execution_id}] Notification successfully sent for event: {event['title']}")
+        return True
+    logger.warning(f"[{execution_id}] Notification failed for event: {event['title']}.")
+    return False
+
+# Recipients' profiles are fetched in chunks so the id=in.(...) URL stays short and
+# one failed query cannot cost the whole day's reminders
+PROFILE_PREFETCH_CHUNK_SIZE = 150
+
+def prefetch_profiles(execution_id, user_ids):
+    # Maps user_id -> profile (None when the user has no profile). Users whose lookup
+    # failed are left out so their events are not claimed.
+    profiles = {}
+    for start in range(0, len(user_ids), PROFILE_PREFETCH_CHUNK_SIZE):
+        chunk = user_ids[start:start + PROFILE_PREFETCH_CHUNK_SIZE]
+        try:
+            response = supabase.table('profiles').select('id, full_name, phone_number').in_('id', chunk).execute()
+            found = {profile['id']: profile for profile in response.data}
+            for user_id in chunk:
+                profiles[user_id] = found.get(user_id)
+        except Exception as e:
+            logger.warning(f"[{execution_id}] Profile prefetch failed for {len(chunk)} user(s): {str(e)}. Falling back to per-user lookups.")
+            for user_id in chunk:
+                try:
+                    response = supabase.table('profiles').select('id, full_name, phone_number').eq('id', user_id).limit(1).execute()
+                    profiles[user_id] = response.data[0] if response.data else None
+                except Exception as e:
+                    logger.error(f"[{execution_id}] Failed to fetch profile for user {user_id}: {str(e)}")
+    return profiles
+
 def check_and_send_notifications():
     execution_id = str(uuid.uuid4())[:8]
     logger.info(f"[{execution_id}] Starting notification check...")
@@ -126,147 +470,98 @@ def check_and_send_notifications():
         ist = pytz.timezone('Asia/Kolkata')
         today = datetime.now(ist).date()
         logger.info(f"[{execution_id}] Current date for check (IST): {today}")
-        response = supabase.table('events').select(
-            'id, title, event_date, days_to_notify, event_type, user_id, notified'
-        ).or_('notified.is.null,notified.eq.').execute()
-        logger.info(f"[{execution_id}] Supabase query returned {len(response.data)} events with notified status NULL/empty.")
-        events_to_process = []
-        for event in response.data:
-            event_date_str = event['event_date']
-            event_date = datetime.strptime(event_date_str, '%Y-%m-%d').date()
-            days_to_notify = event['days_to_notify']
-            notification_date = event_date - timedelta(days=days_to_notify)
-            logger.info(f"[{execution_id}] Event '{event['title']}' (ID: {event['id']}): Event Date: {event_date}, Days to Notify: {days_to_notify}, Calculated Notification Date: {notification_date}")
-            if today == notification_date:
-                events_to_process.append(event)
-                logger.info(f"[{execution_id}] MATCH! Event '{event['title']}' is scheduled for notification today.")
-            elif today > notification_date:
-                supabase.table('events').update({'notified': 'No'}).eq('id', event['id']).execute()
-                logger.info(f"[{execution_id}] Event '{event['title']}' notification date passed ({notification_date}), marked as 'No'")
+        response = supabase.rpc('get_due_events', {'today': today.isoformat()}).execute()
+        events_to_process = response.data or []
+        logger.info(f"[{execution_id}] {len(events_to_process)} event(s) scheduled for notification today.")
+        stale_response = supabase.rpc('mark_stale_events_no', {'today': today.isoformat()}).execute()
+        logger.info(f"[{execution_id}] Marked {stale_response.data or 0} event(s) with passed notification dates as 'No'.")
         if not events_to_process:
-            logger.info(f"[{execution_id}] No events need notification today after date comparison.")
+            logger.info(f"[{execution_id}] No events need notification today.")
             return
         notifications_sent = 0
         notifications_failed = 0
+        # Fetch recipients' profiles up front so the pool only does claims and sends
+        user_ids = list({event['user_id'] for event in events_to_process})
+        profiles = prefetch_profiles(execution_id, user_ids)
+        futures = []
         for event in events_to_process:
-            event_id = event['id']
-            with processing_lock:
-                if event_id in processing_events:
-                    logger.info(f"[{execution_id}] Event {event_id} is already being processed by another instance. Skipping.")
-                    continue
-                else:
-                    processing_events.add(event_id)
-                    logger.info(f"[{execution_id}] Added event {event_id} to processing set.")
+            if event['user_id'] not in profiles:
+                logger.error(f"[{execution_id}] Skipping event {event['id']}: profile for user {event['user_id']} could not be loaded.")
+                notifications_failed += 1
+                continue
+            futures.append(send_pool.submit(notify_event, execution_id, event, profiles[event['user_id']]))
+        for future in as_completed(futures):
             try:
-                current_event_response = supabase.table('events').select('notified').eq('id', event_id).single().execute()
-                if current_event_response.data and current_event_response.data.get('notified') not in [None, '', 'No']:
-                    logger.info(f"[{execution_id}] Event {event_id} has already been notified (status: {current_event_response.data.get('notified')}). Skipping.")
-                    continue
-                update_response = supabase.table('events').update({'notified': 'Yes'}).eq('id', event_id).execute()
-                if update_response.data:
-                    logger.info(f"[{execution_id}] Event '{event['title']}' (ID: {event_id}) successfully marked 'Yes' for notification.")
-                else:
-                    logger.warning(f"[{execution_id}] Event '{event['title']}' (ID: {event_id}) could not be marked 'Yes'. Skipping notification.")
-                    notifications_failed += 1
-                    continue
-                try:
-                    user_response = supabase.table('profiles').select('full_name, phone_number').eq('id', event['user_id']).single().execute()
-                    user_profile = user_response.data
-                except Exception as e:
-                    logger.warning(f"[{execution_id}] No profile found or error fetching profile for user {event['user_id']}: {str(e)}")
-                    notifications_failed += 1
-                    continue
-                if not user_profile or not user_profile.get('phone_number'):
-                    logger.warning(f"[{execution_id}] No phone number found for user {event['user_id']} or profile incomplete.")
-                    notifications_failed += 1
-                    continue
-                event_date_formatted = datetime.strptime(event['event_date'], '%Y-%m-%d').strftime('%B %d, %Y')
-                event_type_text = "recurring event" if event['event_type'] == 'recurrence' else "deadline"
-                user_name = user_profile.get('full_name', 'User')
-                message = f"""
-🔔 Event Reminder
-
-Hi {user_name}!
-
-You have an upcoming {event_type_text}:
-📅 {event['title']}
-📆 Date: {event_date_formatted}
-
-Don't forget to prepare for this important event!
-
-Best regards,
-RemindMe
-                """.strip()
-                if send_whatsapp_notification(
-                    phone_number=user_profile['phone_number'], 
-                    message=message,
-                    user_id=event['user_id'],
-                    event_id=event_id,
-                    notification_type='event_reminder'
-                ):
-                    notifications_sent += 1
-                    logger.info(f"[{execution_id}] Notification successfully sent for event: {event['title']}")
-                else:
-                    notifications_failed += 1
-                    logger.warning(f"[{execution_id}] Notification failed for event: {event['title']}.")
-            finally:
-                with processing_lock:
-                    processing_events.discard(event_id)
-                    logger.info(f"[{execution_id}] Removed event {event_id} from processing set.")
+                result = future.result()
+            except Exception as e:
+                logger.error(f"[{execution_id}] Error processing event notification: {str(e)}")
+                result = False
+            if result is True:
+                notifications_sent += 1
+            elif result is False:
+                notifications_failed += 1
         logger.info(f"[{execution_id}] Notification check completed. Sent {notifications_sent} notifications, failed {notifications_failed}.")
     except Exception as e:
         logger.error(f"[{execution_id}] Critical error in check_and_send_notifications: {str(e)}")
 
+# --- CONTACT FAN-OUT ---
+def send_to_contacts(table, status_column, contacts, body):
+    contact_ids = [contact['id'] for contact in contacts]
+    # Mark every contact as 'processing' up front to avoid duplicate sends
+    supabase.table(table) \
+        .update({status_column: 'processing'}) \
+        .in_('id', contact_ids).execute()
+    futures = {}
+    for contact in contacts:
+        logger.info(f"Sending WhatsApp to {contact['contact_phone']} for contact_id {contact['id']}")
+        futures[send_pool.submit(_send_one, contact['contact_phone'], body)] = contact
+    sent_ids = []
+    failed_ids = []
+    for future in as_completed(futures):
+        contact = futures[future]
+        try:
+            msg = future.result()
+            logger.info(f"Sent to {contact['contact_phone']}, Twilio SID: {msg.sid}")
+            sent_ids.append(contact['id'])
+        except Exception as e:
+            logger.error(f"Failed to send to {contact['contact_phone']}: {e}")
+            failed_ids.append(contact['id'])
+    if sent_ids:
+        supabase.table(table) \
+            .update({status_column: 'sent'}) \
+            .in_('id', sent_ids).execute()
+    if failed_ids:
+        # Revert status so failed contacts are retried on the next run
+        supabase.table(table) \
+            .update({status_column: ''}) \
+            .in_('id', failed_ids).execute()
+    return not failed_ids
+
 # --- SCHEDULER FOR RSVP POLLING ---
 def process_rsvp_messages():
     try:
-        response = supabase.table('rsvp').select('*').or_('status.is.null,status.eq.""').execute()
-        rsvps = response.data
-        if not rsvps:
+        # One query for every pending RSVP joined with its uninvited contacts
+        response = supabase.rpc('pending_rsvps_with_contacts').execute()
+        rows = response.data
+        if not rows:
             logger.info("No pending RSVPs.")
             return
-        for rsvp in rsvps:
-            rsvp_id = rsvp['id']
-            title = rsvp.get('title', 'Event')
-            message_body = rsvp.get('message', '')
+        for rsvp_id, rsvp_rows in groupby(rows, key=itemgetter('rsvp_id')):
+            rsvp_rows = list(rsvp_rows)
             logger.info(f"Processing RSVP id: {rsvp_id}")
-            contacts_resp = supabase.table('rsvp_contact_status') \
-                .select('*') \
-                .eq('rsvp_id', rsvp_id) \
-                .or_('invite_status.is.null,invite_status.eq.""') \
-                .execute()
-            contacts = contacts_resp.data
-            if not contacts:
-                logger.info(f"No contacts to send for rsvp_id {rsvp_id}")
+            contacts = [{'id': row['contact_id'], 'contact_phone': row['phone']} for row in rsvp_rows]
+            sms_body = _RSVP_INVITE_TMPL.format(title=rsvp_rows[0]['title'] or 'Event', message=rsvp_rows[0]['message'] or '')
+            all_sent = send_to_contacts('rsvp_contact_status', 'invite_status', contacts, sms_body)
+            if not all_sent:
+                logger.info(f"Some contacts failed for rsvp_id {rsvp_id}, will retry next run.")
                 continue
-            all_sent = True
-            for contact in contacts:
-                contact_id = contact['id']
-                phone = contact['contact_phone']
-                logger.info(f"Sending RSVP WhatsApp to {phone} for contact_id {contact_id}")
-                try:
-                    supabase.table('rsvp_contact_status') \
-                        .update({'invite_status': 'processing'}) \
-                        .eq('id', contact_id).execute()
-                    sms_body = f"{title}\n{message_body}\n\nIf attending, respond by replying 'rsvp: yes'. If not, reply 'rsvp: no'."
-                    msg = twilio_client.messages.create(
-                        body=sms_body,
-                        from_=twilio_whatsapp_number,
-                        to=f"whatsapp:{phone}" if not str(phone).startswith("whatsapp:") else phone
-                    )
-                    logger.info(f"Sent to {phone}, Twilio SID: {msg.sid}")
-                    supabase.table('rsvp_contact_status') \
-                        .update({'invite_status': 'sent'}).eq('id', contact_id).execute()
-                except Exception as e:
-                    logger.error(f"Failed to send to {phone}: {e}")
-                    supabase.table('rsvp_contact_status') \
-                        .update({'invite_status': ''}).eq('id', contact_id).execute()
-                    all_sent = False
-            if all_sent:
-                supabase.table('rsvp').update({'status': 'sent'}).eq('id', rsvp_id).execute()
+            # PostgREST may have cut the RPC response short at max-rows, so the database
+            # decides whether any contacts of this RSVP are still uninvited
+            marked = supabase.rpc('mark_rsvp_sent_if_complete', {'p_rsvp_id': rsvp_id}).execute()
+            if marked.data:
                 logger.info(f"All contacts sent for rsvp_id {rsvp_id}, updated RSVP status to sent.")
             else:
-                logger.info(f"Some contacts failed for rsvp_id {rsvp_id}, will retry next run.")
+                logger.info(f"Sent {len(contacts)} contact(s) for rsvp_id {rsvp_id}; more remain, will continue next run.")
     except Exception as e:
         logger.error(f"Error in process_rsvp_messages: {e}")
 
@@ -293,32 +588,7 @@ def process_messages():
             if not contacts:
                 logger.info(f"No contacts to send for message_id {message_id}")
                 continue
-            all_sent = True
-            for contact in contacts:
-                contact_id = contact['id']
-                phone = contact['contact_phone']
-                logger.info(f"Sending WhatsApp to {phone} for contact_id {contact_id}")
-                try:
-                    # Mark as 'processing' to avoid duplicate sends
-                    supabase.table('message_contact') \
-                        .update({'status': 'processing'}) \
-                        .eq('id', contact_id).execute()
-                    # Send WhatsApp message
-                    msg = twilio_client.messages.create(
-                        body=message_text,
-                        from_=twilio_whatsapp_number,
-                        to=f"whatsapp:{phone}" if not str(phone).startswith("whatsapp:") else phone
-                    )
-                    logger.info(f"Sent to {phone}, Twilio SID: {msg.sid}")
-                    # Mark as sent
-                    supabase.table('message_contact') \
-                        .update({'status': 'sent'}).eq('id', contact_id).execute()
-                except Exception as e:
-                    logger.error(f"Failed to send to {phone}: {e}")
-                    # Optionally revert status so it retries later
-                    supabase.table('message_contact') \
-                        .update({'status': ''}).eq('id', contact_id).execute()
-                    all_sent = False
+            all_sent = send_to_contacts('message_contact', 'status', contacts, message_text)
             # 3. If all contacts were successfully sent, mark message as sent
             if all_sent:
                 supabase.table('messages').update({'status': 'sent'}).eq('id', message_id).execute()
@@ -329,151 +599,300 @@ def process_messages():
         logger.error(f"Error in process_messages: {e}")
 
 # --- AI INTEGRATION FUNCTIONS ---
+# Phone number -> user_id mapping rarely changes, so cache it. Misses are cached
+# briefly so a number registered later is picked up quickly.
+user_id_cache = TTLCache(maxsize=10_000, ttl=3600)
+user_id_miss_cache = TTLCache(maxsize=10_000, ttl=60)
+user_id_cache_lock = threading.Lock()
+
 def get_user_id_from_whatsapp_number(whatsapp_number):
     phone_number_clean = whatsapp_number.replace('whatsapp:', '')
+    with user_id_cache_lock:
+        if phone_number_clean in user_id_cache:
+            return user_id_cache[phone_number_clean]
+        if phone_number_clean in user_id_miss_cache:
+            return None
     try:
-        response = supabase.table('profiles').select('id').eq('phone_number', phone_number_clean).single().execute()
-        if response.data:
-            return response.data['id']
-        return None
+        response = supabase.table('profiles').select('id').eq('phone_number', phone_number_clean).limit(1).execute()
+        user_id = response.data[0]['id'] if response.data else None
     except Exception as e:
         logger.error(f"Error fetching user ID for {whatsapp_number}: {str(e)}")
         return None
+    with user_id_cache_lock:
+        if user_id:
+            user_id_cache[phone_number_clean] = user_id
+        else:
+            user_id_miss_cache[phone_number_clean] = True
+    return user_id
 
-def get_user_events(user_id, month=None, year=None, upcoming_only=False):
+# Per-user cache of all events, served stale-while-revalidate: entries younger than
+# EVENTS_CACHE_TTL are returned as-is, older ones (up to EVENTS_CACHE_MAX_STALE) are
+# returned immediately while a background refresh runs. Entries past
+# EVENTS_CACHE_MAX_STALE are evicted, so only recently active users stay cached.
+EVENTS_CACHE_TTL = 30
+EVENTS_CACHE_MAX_STALE = 300
+events_cache = TTLCache(maxsize=10_000, ttl=EVENTS_CACHE_MAX_STALE)
+events_cache_lock = threading.Lock()
+events_refreshing = set()
+
+def fetch_user_events(user_id):
+    response = supabase.table('events').select('*').eq('user_id', user_id).execute()
+    events = response.data
+    with events_cache_lock:
+        events_cache[user_id] = (time.monotonic(), events)
+    return events
+
+def refresh_user_events(user_id):
     try:
-        query = supabase.table('events').select('*').eq('user_id', user_id)
-        if month and year:
-            start_date = f"{year}-{month:02d}-01"
-            if month == 12:
-                end_date = f"{year + 1}-01-01"
-            else:
-                end_date = f"{year}-{month + 1:02d}-01"
-            query = query.gte('event_date', start_date).lt('event_date', end_date)
+        fetch_user_events(user_id)
+    except Exception as e:
+        logger.error(f"Error refreshing events for user {user_id}: {str(e)}")
+    finally:
+        with events_cache_lock:
+            events_refreshing.discard(user_id)
+
+def get_cached_user_events(user_id):
+    with events_cache_lock:
+        cached = events_cache.get(user_id)
+        if cached:
+            fetched_at, events = cached
+            age = time.monotonic() - fetched_at
+            if age < EVENTS_CACHE_TTL:
+                return events
+            if age < EVENTS_CACHE_MAX_STALE:
+                if user_id not in events_refreshing:
+                    events_refreshing.add(user_id)
+                    threading.Thread(target=refresh_user_events, args=(user_id,), daemon=True).start()
+                return events
+    return fetch_user_events(user_id)
+
+def get_user_events(user_id, month=None, year=None, upcoming_only=False, start_date=None, end_date=None):
+    try:
+        events = get_cached_user_events(user_id)
+        if start_date and end_date:
+            # ISO dates compare correctly as strings
+            return [e for e in events if start_date <= e['event_date'] < end_date]
+        elif month and year:
+            month_prefix = f"{year}-{month:02d}"
+            return [e for e in events if e['event_date'][:7] == month_prefix]
         elif upcoming_only:
             today = datetime.now().date().isoformat()
-            query = query.gte('event_date', today)
-        response = query.execute()
-        return response.data
+            return [e for e in events if e['event_date'] >= today]
+        return events
     except Exception as e:
         logger.error(f"Error fetching events for user {user_id}: {str(e)}")
         return []
 
-def analyze_event_query(message_text):
-    message_lower = message_text.lower()
-    month_names = {
-        'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6,
-        'july': 7, 'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12
-    }
-    for month_name, month_num in month_names.items():
-        if month_name in message_lower:
-            return f'specific_month_{month_num}'
-    if any(word in message_lower for word in ['this month', 'current month', 'month']):
-        return 'current_month'
-    elif any(word in message_lower for word in ['next month', 'following month']):
-        return 'next_month'
-    elif any(word in message_lower for word in ['this week', 'current week', 'week']):
-        return 'current_week'
-    elif any(word in message_lower for word in ['upcoming', 'future', 'coming', 'ahead']):
-        return 'upcoming'
-    elif any(word in message_lower for word in ['all', 'everything', 'list']):
-        return 'all'
+MONTH_NUMBERS = {
+    'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6,
+    'july': 7, 'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12
+}
+_MONTH_RE = re.compile(r'\b(' + '|'.join(MONTH_NUMBERS) + r')\b')
+
+class Intent(Enum):
+    MONTH = 'month'
+    CURRENT_MONTH = 'current_month'
+    NEXT_MONTH = 'next_month'
+    CURRENT_WEEK = 'current_week'
+    UPCOMING = 'upcoming'
+    ALL = 'all'
+
+# Messages matching none of these skip the events fetch. Covers every month name and
+# each intent's vocabulary below, plus day words, so the gate never hides an intent.
+_EVENT_KEYWORDS_RE = re.compile(
+    r'\b(?:event|schedule|calendar|remind|deadline|due|appointment|meeting|plan|busy|free'
+    r'|today|tonight|tomorrow|yesterday|day|date|week|weekend|month|year'
+    r'|monday|tuesday|wednesday|thursday|friday|saturday|sunday'
+    r'|next|following|upcoming|future|coming|ahead|all|everything|list|'
+    + '|'.join(MONTH_NUMBERS) + r')'
+)
+
+# Checked in order; the first matching intent wins
+_INTENT_RES = [
+    (Intent.NEXT_MONTH, re.compile(r'\b(?:next|following) month')),
+    (Intent.CURRENT_MONTH, re.compile(r'\bmonth')),
+    (Intent.CURRENT_WEEK, re.compile(r'\bweek')),
+    (Intent.UPCOMING, re.compile(r'\b(?:upcoming|future|coming|ahead)\b')),
+    (Intent.ALL, re.compile(r'\b(?:all|everything|list)\b')),
+]
+
+def analyze_event_query(message_lower):
+    month_match = _MONTH_RE.search(message_lower)
+    if month_match:
+        return Intent.MONTH, MONTH_NUMBERS[month_match.group(1)]
+    for intent, pattern in _INTENT_RES:
+        if pattern.search(message_lower):
+            return intent, None
+    return Intent.CURRENT_MONTH, None
+
+# Each handler returns (events, period_text) for its intent
+def _events_for_month(user_id, month_num, current_date):
+    target_year = current_date.year
+    if month_num < current_date.month:
+        target_year = current_date.year + 1
+    return get_user_events(user_id, month_num, target_year), datetime(target_year, month_num, 1).strftime('%B %Y')
+
+def _events_for_current_month(user_id, payload, current_date):
+    return get_user_events(user_id, current_date.month, current_date.year), current_date.strftime('%B %Y')
+
+def _events_for_next_month(user_id, payload, current_date):
+    next_month = current_date.month + 1 if current_date.month < 12 else 1
+    next_year = current_date.year if current_date.month < 12 else current_date.year + 1
+    return get_user_events(user_id, next_month, next_year), datetime(next_year, next_month, 1).strftime('%B %Y')
+
+def _events_for_current_week(user_id, payload, current_date):
+    week_start = current_date - timedelta(days=current_date.weekday())
+    week_end = week_start + timedelta(days=7)
+    events = get_user_events(user_id, start_date=week_start.date().isoformat(), end_date=week_end.date().isoformat())
+    return events, f"this week (starting {week_start.strftime('%B %d')})"
+
+def _events_upcoming(user_id, payload, current_date):
+    return get_user_events(user_id, upcoming_only=True), "upcoming"
+
+def _events_all(user_id, payload, current_date):
+    return get_user_events(user_id), "all time"
+
+INTENT_HANDLERS = {
+    Intent.MONTH: _events_for_month,
+    Intent.CURRENT_MONTH: _events_for_current_month,
+    Intent.NEXT_MONTH: _events_for_next_month,
+    Intent.CURRENT_WEEK: _events_for_current_week,
+    Intent.UPCOMING: _events_upcoming,
+    Intent.ALL: _events_all,
+}
+
+def annotate_events(events, today):
+    # Parse each event date once; cached events keep their parsed fields across calls
+    for event in events:
+        if '_date' not in event:
+            event['_date'] = date.fromisoformat(event['event_date'])
+            event['_date_fmt'] = event['_date'].strftime('%B %d, %Y')
+        event['_days_until'] = (event['_date'] - today).days
+    return events
+
+def format_event_line(event):
+    event_type = "recurring event" if event['event_type'] == 'recurrence' else "deadline"
+    days_until = event['_days_until']
+    if days_until == 0:
+        time_info = " (today)"
+    elif days_until == 1:
+        time_info = " (tomorrow)"
+    elif days_until > 0:
+        time_info = f" (in {days_until} days)"
     else:
-        return 'current_month'
+        time_info = f" ({abs(days_until)} days ago)"
+    return f"- {event['title']} ({event_type}) on {event['_date_fmt']}{time_info}"
+
+def load_conversation_history(user_id):
+    # Returns the history and the idx of its newest row (0 when there is none)
+    try:
+        response = supabase.table('conversations') \
+            .select('idx, role, content') \
+            .eq('user_id', user_id) \
+            .order('idx', desc=True) \
+            .limit(CONVERSATION_HISTORY_LIMIT) \
+            .execute()
+    except Exception as e:
+        logger.error(f"Error loading conversation history for user {user_id}: {str(e)}")
+        return [], None
+    rows = response.data
+    history = [{'role': row['role'], 'parts': [row['content']]} for row in reversed(rows)]
+    return history, rows[0]['idx'] if rows else 0
+
+def get_latest_conversation_idx(user_id):
+    try:
+        response = supabase.table('conversations') \
+            .select('idx') \
+            .eq('user_id', user_id) \
+            .order('idx', desc=True) \
+            .limit(1) \
+            .execute()
+    except Exception as e:
+        logger.error(f"Error checking conversation history for user {user_id}: {str(e)}")
+        return None
+    return response.data[0]['idx'] if response.data else 0
+
+def save_conversation_turn(user_id, user_text, model_text):
+    # Returns the idx of the saved model message, or None if the insert failed
+    try:
+        response = supabase.table('conversations').insert([
+            {'user_id': user_id, 'role': 'user', 'content': user_text},
+            {'user_id': user_id, 'role': 'model', 'content': model_text}
+        ]).execute()
+        return max(row['idx'] for row in response.data)
+    except Exception as e:
+        logger.error(f"Error saving conversation turn for user {user_id}: {str(e)}")
+        return None
+
+def get_chat_session(user_id):
+    with chat_sessions_lock:
+        session = chat_sessions.get(user_id)
+    if session:
+        # Another worker may have answered this user since; if so, rebuild from the table
+        latest_idx = get_latest_conversation_idx(user_id)
+        if latest_idx is None or latest_idx == session['idx']:
+            return session
+        logger.info(f"Conversation for user {user_id} has newer turns in the database; reloading chat session.")
+        with chat_sessions_lock:
+            if chat_sessions.get(user_id) is session:
+                chat_sessions.pop(user_id, None)
+    history, last_idx = load_conversation_history(user_id)
+    if not history:
+        logger.info(f"Started new conversation for user {user_id}.")
+    session = {'chat': gemini_model.start_chat(history=history), 'lock': threading.Lock(), 'idx': last_idx}
+    with chat_sessions_lock:
+        # Another thread may have created a session for this user meanwhile
+        return chat_sessions.setdefault(user_id, session)
 
 def get_gemini_response(user_id, message_text):
     if not gemini_model:
         return "I'm sorry, the AI service is currently unavailable. Please try again later."
-    with conversations_lock:
-        current_time = datetime.now()
-        if user_id not in conversations:
-            conversations[user_id] = {
-                'last_message_time': current_time,
-                'history': []
-            }
-            logger.info(f"Started new conversation for user {user_id}.")
-        conversations[user_id]['last_message_time'] = current_time
-        try:
+    try:
+        events_context = ""
+        message_lower = message_text.lower()
+        # Only load events when the message is about them
+        if _EVENT_KEYWORDS_RE.search(message_lower):
             all_user_events = get_user_events(user_id)
             current_date = datetime.now()
-            events_context = ""
+            today = current_date.date()
+            annotate_events(all_user_events, today)
             if all_user_events:
-                events_context = f"\n\nHere are ALL your events from the database:\n"
-                for event in all_user_events:
-                    event_date = datetime.strptime(event['event_date'], '%Y-%m-%d').strftime('%B %d, %Y')
-                    event_type = "recurring event" if event['event_type'] == 'recurrence' else "deadline"
-                    days_until = (datetime.strptime(event['event_date'], '%Y-%m-%d').date() - current_date.date()).days
-                    if days_until == 0:
-                        time_info = " (today)"
-                    elif days_until == 1:
-                        time_info = " (tomorrow)"
-                    elif days_until > 0:
-                        time_info = f" (in {days_until} days)"
-                    else:
-                        time_info = f" ({abs(days_until)} days ago)"
-                    events_context += f"- {event['title']} ({event_type}) on {event_date}{time_info}\n"
-                events_context += f"\nTotal: {len(all_user_events)} event(s) in your database."
+                context_parts = ["\n\nHere are ALL your events from the database:"]
+                context_parts.extend(format_event_line(event) for event in all_user_events)
+                context_parts.append(f"\nTotal: {len(all_user_events)} event(s) in your database.")
+                events_context = "\n".join(context_parts)
+            else:
+                events_context = "\n\nYou have no events in your database."
+            intent, payload = analyze_event_query(message_lower)
+            filtered_events, period_text = INTENT_HANDLERS[intent](user_id, payload, current_date)
+            if filtered_events:
+                annotate_events(filtered_events, today)
+                filtered_parts = [f"\n\nFiltered events for {period_text}:"]
+                filtered_parts.extend(format_event_line(event) for event in filtered_events)
+                filtered_parts.append(f"\nFiltered total: {len(filtered_events)} event(s) for {period_text}")
+                events_context += "\n".join(filtered_parts)
             else:
-                events_context = f"\n\nYou have no events in your database."
-            message_lower = message_text.lower()
-            if any(keyword in message_lower for keyword in ['event', 'events', 'schedule', 'calendar', 'reminder', 'deadline', 'appointment', 'meeting', 'september', 'month', 'week']):
-                query_type = analyze_event_query(message_text)
-                if query_type.startswith('specific_month_'):
-                    month_num = int(query_type.split('_')[2])
-                    target_year = current_date.year
-                    if month_num < current_date.month:
-                        target_year = current_date.year + 1
-                    filtered_events = get_user_events(user_id, month_num, target_year)
-                    period_text = f"{datetime(target_year, month_num, 1).strftime('%B %Y')}"
-                elif query_type == 'current_month':
-                    current_month_events = get_user_events(user_id, current_date.month, current_date.year)
-                    period_text = f"{current_date.strftime('%B %Y')}"
-                    filtered_events = current_month_events
-                elif query_type == 'next_month':
-                    next_month = current_date.month + 1 if current_date.month < 12 else 1
-                    next_year = current_date.year if current_date.month < 12 else current_date.year + 1
-                    filtered_events = get_user_events(user_id, next_month, next_year)
-                    period_text = f"{datetime(current_date.year, next_month, 1).strftime('%B %Y')}"
-                elif query_type == 'current_week':
-                    upcoming_events = get_user_events(user_id, upcoming_only=True)
-                    week_start = current_date - timedelta(days=current_date.weekday())
-                    week_end = week_start + timedelta(days=7)
-                    filtered_events = [e for e in upcoming_events if week_start.date() <= datetime.strptime(e['event_date'], '%Y-%m-%d').date() < week_end.date()]
-                    period_text = f"this week (starting {week_start.strftime('%B %d')})"
-                elif query_type == 'upcoming':
-                    filtered_events = get_user_events(user_id, upcoming_only=True)
-                    period_text = "upcoming"
-                else:
-                    filtered_events = all_user_events
-                    period_text = "all time"
-                if filtered_events:
-                    events_context += f"\n\nFiltered events for {period_text}:\n"
-                    for event in filtered_events:
-                        event_date = datetime.strptime(event['event_date'], '%Y-%m-%d').strftime('%B %d, %Y')
-                        event_type = "recurring event" if event['event_type'] == 'recurrence' else "deadline"
-                        days_until = (datetime.strptime(event['event_date'], '%Y-%m-%d').date() - current_date.date()).days
-                        if days_until == 0:
-                            time_info = " (today)"
-                        elif days_until == 1:
-                            time_info = " (tomorrow)"
-                        elif days_until > 0:
-                            time_info = f" (in {days_until} days)"
-                        else:
-                            time_info = f" ({abs(days_until)} days ago)"
-                        events_context += f"- {event['title']} ({event_type}) on {event_date}{time_info}\n"
-                    events_context += f"\nFiltered total: {len(filtered_events)} event(s) for {period_text}"
-                else:
-                    events_context += f"\n\nNo events found for {period_text}."
-            enhanced_message = f"{message_text}\n\nContext: You are an AI assistant for RemindMe, a reminder app. You have access to the user's event database. Use this information to answer their questions about events, schedules, reminders, etc.{events_context}"
-            chat = gemini_model.start_chat(history=conversations[user_id]['history'])
+                events_context += f"\n\nNo events found for {period_text}."
+        enhanced_message = f"{message_text}\n\nContext: You are an AI assistant for RemindMe, a reminder app. You have access to the user's event database. Use this information to answer their questions about events, schedules, reminders, etc.{events_context}"
+        session = get_chat_session(user_id)
+        with session['lock']:
+            chat = session['chat']
             response = chat.send_message(enhanced_message)
-            conversations[user_id]['history'].append({'role': 'user', 'parts': [message_text]})
-            conversations[user_id]['history'].append({'role': 'model', 'parts': [response.text]})
-            logger.info(f"Gemini response for user {user_id}: {response.text}")
-            return response.text
-        except Exception as e:
-            logger.error(f"Error getting Gemini response for user {user_id}: {str(e)}")
-            return "I'm sorry, I couldn't process your request at the moment. Please try again."
+            # Keep only the user's own text in the session, not the events context
+            history = chat.history
+            history[-2] = {'role': 'user', 'parts': [message_text]}
+            chat.history = history
+            saved_idx = save_conversation_turn(user_id, message_text, response.text)
+            if saved_idx is not None:
+                session['idx'] = saved_idx
+            if len(history) > CHAT_SESSION_MAX_MESSAGES:
+                with chat_sessions_lock:
+                    chat_sessions.pop(user_id, None)
+        logger.info(f"Gemini response for user {user_id}: {response.text}")
+        return response.text
+    except Exception as e:
+        logger.error(f"Error getting Gemini response for user {user_id}: {str(e)}")
+        return "I'm sorry, I couldn't process your request at the moment. Please try again."
 
 # --- UNIFIED TWILIO WEBHOOK ROUTE ---
 @app.route('/webhook/twilio', methods=['POST'])
@@ -518,11 +937,7 @@ def handle_rsvp_reply(from_number, body):
             try:
                 confirmation_msg = "Thanks for your response! Your RSVP has been recorded."
                 if from_number:
-                    twilio_client.messages.create(
-                        body=confirmation_msg,
-                        from_=twilio_whatsapp_number,
-                        to=from_number
-                    )
+                    _send_one(from_number, confirmation_msg)
                     logger.info(f"Sent confirmation to {from_number}")
             except Exception as e:
                 logger.error(f"Failed to send confirmation to {from_number}: {e}")
@@ -535,6 +950,24 @@ def handle_rsvp_reply(from_number, body):
     return Response(str(resp), mimetype='text/xml')
 
 # --- AI CONVERSATION HANDLER ---
+# Gemini replies take seconds, longer than Twilio is willing to wait on the webhook,
+# so the reply is generated and sent from a background pool.
+ai_reply_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='ai-reply')
+
+def send_ai_reply(user_id, from_whatsapp_number, incoming_msg):
+    try:
+        gemini_reply = get_gemini_response(user_id, incoming_msg)
+        phone_number_clean = from_whatsapp_number.replace('whatsapp:', '')
+        send_whatsapp_notification(
+            phone_number=phone_number_clean,
+            message=gemini_reply,
+            user_id=user_id,
+            event_id=None,
+            notification_type='ai_response'
+        )
+    except Exception as e:
+        logger.error(f"Error sending AI reply to {from_whatsapp_number}: {str(e)}")
+
 def handle_ai_conversation(from_whatsapp_number, incoming_msg):
     resp = MessagingResponse()
     user_id = get_user_id_from_whatsapp_number(from_whatsapp_number)
@@ -542,49 +975,276 @@ def handle_ai_conversation(from_whatsapp_number, incoming_msg):
         logger.warning(f"Could not find user_id for WhatsApp number: {from_whatsapp_number}. Cannot start AI conversation.")
         resp.message("I'm sorry, I can't identify your account. Please ensure your phone number is registered in our system.")
         return Response(str(resp), mimetype='text/xml')
-    gemini_reply = get_gemini_response(user_id, incoming_msg)
-    phone_number_clean = from_whatsapp_number.replace('whatsapp:', '')
-    log_notification_to_db(
-        user_id=user_id,
-        event_id=None,
-        notification_type='ai_response',
-        notification_content=gemini_reply,
-        phone_number=phone_number_clean,
-        twilio_message_sid=None,
-        delivery_status='sent'
-    )
-    resp.message(gemini_reply)
+    ai_reply_pool.submit(send_ai_reply, user_id, from_whatsapp_number, incoming_msg)
     return Response(str(resp), mimetype='text/xml')
 
-# --- SCHEDULER THREAD ---
-def run_scheduler():
-    schedule.every().day.at("00:43").do(check_and_send_notifications)
-    # schedule.every().minute.do(check_and_send_notifications)  # For testing
-    logger.info("Scheduler started. Notifications will be sent daily at 21:20")
+# --- APSCHEDULER FOR NOTIFICATIONS AND RSVP POLLING ---
+# Overlapping runs of a job are dropped and missed runs collapse into one
+scheduler = BackgroundScheduler(
+    executors={'default': SchedulerThreadPoolExecutor(8)},
+    job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 30}
+)
+scheduler.add_job(func=process_rsvp_messages, trigger="interval", seconds=15, id='rsvp_poll')
+scheduler.add_job(func=process_messages, trigger="interval", seconds=15, id='messages_poll')
+# Daily reminder check
+scheduler.add_job(func=check_and_send_notifications, trigger=CronTrigger(hour=0, minute=43), id='daily_notify')
+
+# --- SCHEDULER LEADER ELECTION ---
+# Every WSGI worker imports this module, so only the worker holding this
+# session-level advisory lock runs the scheduler. The lock is tied to the
+# connection below and is released by Postgres when the worker exits or the
+# connection drops.
+SCHEDULER_LOCK_KEY = 0x52494D44  # ASCII "RIMD"
+SCHEDULER_LOCK_RETRY_SECONDS = 60
+SCHEDULER_LOCK_CHECK_SECONDS = 15
+_scheduler_lock_conn = None
+
+def acquire_scheduler_lock():
+    global _scheduler_lock_conn
+    if not database_url:
+        # Only the single-process dev server may run the scheduler uncoordinated
+        return bool(os.getenv('DEV'))
+    try:
+        # TCP keepalives surface a dead connection (and so a lost lock) within about a minute
+        conn = psycopg2.connect(
+            database_url,
+            connect_timeout=10,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (SCHEDULER_LOCK_KEY,))
+            acquired = cur.fetchone()[0]
+        if acquired:
+            # Keep the connection open while leading to hold the lock
+            _scheduler_lock_conn = conn
+        else:
+            conn.close()
+        return acquired
+    except Exception as e:
+        logger.error(f"Failed to acquire scheduler advisory lock: {str(e)}")
+        return False
+
+def scheduler_lock_held():
+    try:
+        with _scheduler_lock_conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        return True
+    except Exception as e:
+        logger.error(f"Scheduler lock connection lost: {str(e)}")
+        return False
+
+def start_scheduler_if_leader():
+    if not acquire_scheduler_lock():
+        return False
+    logger.info(f"PID {os.getpid()} acquired scheduler lock; starting scheduler. Notifications will be sent daily at 00:43.")
+    if scheduler.running:
+        # Paused after an earlier step-down
+        scheduler.resume()
+    else:
+        scheduler.start()
+    return True
+
+def step_down_scheduler():
+    global _scheduler_lock_conn
+    # Postgres released the lock with the connection, so a standby may already be leading.
+    # Pausing (rather than shutting down) keeps the scheduler restartable if this worker
+    # wins the lock again.
+    scheduler.pause()
+    try:
+        _scheduler_lock_conn.close()
+    except Exception:
+        pass
+    _scheduler_lock_conn = None
+    logger.warning(f"PID {os.getpid()} paused the scheduler and returned to standby.")
+
+def run_scheduler_election():
+    # Standby workers keep trying so one of them takes over if the leader dies; the
+    # leader keeps checking its lock so two workers never run the jobs at once.
     while True:
-        schedule.run_pending()
-        time.sleep(60)
+        if _scheduler_lock_conn is None:
+            if not start_scheduler_if_leader():
+                time.sleep(SCHEDULER_LOCK_RETRY_SECONDS)
+                continue
+        time.sleep(SCHEDULER_LOCK_CHECK_SECONDS)
+        if not scheduler_lock_held():
+            step_down_scheduler()
+
+def scheduler_bootstrap():
+    if scheduler.running:
+        return True
+    if not database_url:
+        if not os.getenv('DEV'):
+            # Every gunicorn worker would run the scheduler and send each message N times
+            logger.error("DATABASE_URL not set; cannot coordinate the scheduler across workers, so it will not run. Set DATABASE_URL or DEV=1.")
+            return False
+        return start_scheduler_if_leader()
+    leader = start_scheduler_if_leader()
+    if not leader:
+        logger.info(f"Scheduler lock held by another worker; PID {os.getpid()} will retry every {SCHEDULER_LOCK_RETRY_SECONDS}s.")
+    threading.Thread(target=run_scheduler_election, daemon=True, name='scheduler-election').start()
+    return leader
+
+# --- NOTIFICATION HISTORY LOADER ---
+# Coalesces concurrent /notifications/<user_id> reads arriving within a short
+# window into a single Supabase query.
+NOTIFICATIONS_PAGE_SIZE = 50
+
+class NotificationLoader:
+    def __init__(self, window=0.01, max_batch=100):
+        self._window = window
+        self._max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
 
-# --- APSCHEDULER FOR RSVP POLLING ---
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=process_rsvp_messages, trigger="interval", seconds=15)
-scheduler.add_job(func=process_messages, trigger="interval", seconds=15)
-scheduler.start()
+    def load(self, user_id):
+        future = Future()
+        batch = None
+        with self._lock:
+            self._pending.setdefault(user_id, []).append(future)
+            if len(self._pending) >= self._max_batch:
+                batch = self._take_batch()
+            elif self._timer is None:
+                self._timer = threading.Timer(self._window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            self._dispatch(batch)
+        return future
+
+    def _take_batch(self):
+        batch, self._pending = self._pending, {}
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self):
+        with self._lock:
+            batch = self._take_batch()
+        if batch:
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        try:
+            response = supabase.rpc('recent_notifications_for_users', {
+                'user_ids': list(batch),
+                'per_user': NOTIFICATIONS_PAGE_SIZE
+            }).execute()
+            # One row per user, so a full batch stays far below PostgREST's max-rows cap
+            rows_by_user = {row['user_id'].lower(): row['notifications'] for row in response.data}
+            for user_id, futures in batch.items():
+                rows = rows_by_user.get(user_id.lower(), [])
+                for future in futures:
+                    future.set_result(rows)
+        except Exception as e:
+            logger.error(f"Error loading notifications for {len(batch)} user(s): {str(e)}")
+            for futures in batch.values():
+                for future in futures:
+                    future.set_exception(e)
+
+notification_loader = NotificationLoader()
 
 # --- FLASK ROUTES ---
+def ojson(obj, status=200):
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+# Most routes answer with {"status": ..., "message": ...}; only the message varies
+_OK_PREFIX = b'{"status":"success","message":'
+_ERROR_PREFIX = b'{"status":"error","message":'
+_SUFFIX = b'}'
+
+def ok_msg(message, status=200):
+    return Response(_OK_PREFIX + orjson.dumps(message) + _SUFFIX, status=status, mimetype='application/json')
+
+def error_msg(message, status=500):
+    return Response(_ERROR_PREFIX + orjson.dumps(message) + _SUFFIX, status=status, mimetype='application/json')
+
+# Flask-Compress rewrites a compressed response's ETag to "<etag>:<algorithm>", and
+# clients send that form back in If-None-Match
+_ETAG_SUFFIXES = [''] + [f':{algorithm}' for algorithm in app.config['COMPRESS_ALGORITHM']]
+
+def not_modified(etag):
+    # Answered before the body is built, so an unchanged poll is never compressed again
+    for suffix in _ETAG_SUFFIXES:
+        if request.if_none_match.contains(etag + suffix):
+            resp = Response(status=304)
+            resp.set_etag(etag + suffix)
+            return resp
+    return None
+
 @app.route('/check-notifications', methods=['GET'])
 def manual_check_notifications():
     try:
         check_and_send_notifications()
-        return jsonify({
-            'status': 'success',
-            'message': 'Manual notification check completed. Check server logs for details.'
+        return ok_msg('Manual notification check completed. Check server logs for details.')
+    except Exception as e:
+        return error_msg(str(e), 500)
+
+# Test sends run in the background; clients poll the job state. Job state lives in
+# Redis when configured, otherwise in the Supabase 'test_notification_jobs' table, so
+# any worker can answer the poll.
+TEST_JOB_TTL = 3600
+test_notification_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='test-notification')
+
+def set_test_job_state(job_id, state):
+    # Raises if the state could not be stored anywhere shared
+    if redis_client:
+        try:
+            redis_client.set(f'job:{job_id}', orjson.dumps(state), ex=TEST_JOB_TTL)
+            return
+        except Exception as e:
+            logger.warning(f"Failed to store test job {job_id} in Redis: {str(e)}. Falling back to Supabase.")
+    supabase.table('test_notification_jobs').upsert({'job_id': job_id, 'state': state}).execute()
+
+def get_test_job_state(job_id):
+    if redis_client:
+        try:
+            state = redis_client.get(f'job:{job_id}')
+            if state is not None:
+                return orjson.loads(state)
+        except Exception as e:
+            logger.warning(f"Failed to read test job {job_id} from Redis: {str(e)}")
+    cutoff = datetime.now(pytz.utc) - timedelta(seconds=TEST_JOB_TTL)
+    response = supabase.table('test_notification_jobs') \
+        .select('state') \
+        .eq('job_id', job_id) \
+        .gte('created_at', cutoff.isoformat()) \
+        .limit(1) \
+        .execute()
+    return response.data[0]['state'] if response.data else None
+
+def purge_expired_test_jobs():
+    if redis_client:
+        return
+    try:
+        cutoff = datetime.now(pytz.utc) - timedelta(seconds=TEST_JOB_TTL)
+        supabase.table('test_notification_jobs').delete().lt('created_at', cutoff.isoformat()).execute()
+    except Exception as e:
+        logger.warning(f"Failed to purge expired test jobs: {str(e)}")
+
+def run_test_notification_job(job_id, user_id, user_profile):
+    test_message = _TEST_NOTIFICATION_TMPL.format(name=user_profile.get('full_name') or 'User')
+    sent = send_whatsapp_notification(
+        phone_number=user_profile['phone_number'],
+        message=test_message,
+        user_id=user_id,
+        event_id=None,
+        notification_type='test_notification'
+    )
+    try:
+        set_test_job_state(job_id, {
+            'status': 'sent' if sent else 'failed',
+            'job_id': job_id,
+            'phone_number': user_profile['phone_number']
         })
     except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+        logger.error(f"Failed to store result of test job {job_id}: {str(e)}")
+    purge_expired_test_jobs()
 
 @app.route('/test-notification/<user_id>', methods=['GET'])
 def test_notification(user_id):
@@ -592,78 +1252,162 @@ def test_notification(user_id):
         user_response = supabase.table('profiles').select('full_name, phone_number').eq('id', user_id).single().execute()
         user_profile = user_response.data
         if not user_profile or not user_profile.get('phone_number'):
-            return jsonify({
-                'status': 'error',
-                'message': 'User not found or no phone number'
-            }), 404
-        test_message = f"""
-🔔 Test Notification
-
-Hi {user_profile.get('full_name', 'User')}!
-
-This is a test message from RemindMe to verify WhatsApp notifications are working correctly.
-
-If you received this message, your notifications are set up properly! 🎉
-        """.strip()
-        if send_whatsapp_notification(
-            phone_number=user_profile['phone_number'], 
-            message=test_message,
-            user_id=user_id,
-            event_id=None,
-            notification_type='test_notification'
-        ):
-            return jsonify({
-                'status': 'success',
-                'message': f'Test notification sent to {user_profile["phone_number"]}'
-            })
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': 'Failed to send test notification'
-            }), 500
+            return error_msg('User not found or no phone number', 404)
+        job_id = uuid.uuid4().hex
+        # Fails the request rather than handing out a job id no other worker could find
+        set_test_job_state(job_id, {'status': 'queued', 'job_id': job_id})
+        test_notification_pool.submit(run_test_notification_job, job_id, user_id, user_profile)
+        resp = ojson({'status': 'queued', 'job_id': job_id}, 202)
+        resp.headers['Location'] = f'/test-notification/jobs/{job_id}'
+        return resp
+    except Exception as e:
+        return error_msg(str(e), 500)
+
+@app.route('/test-notification/jobs/<job_id>', methods=['GET'])
+def test_notification_job(job_id):
+    try:
+        state = get_test_job_state(job_id)
     except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+        logger.error(f"Error fetching test job {job_id}: {str(e)}")
+        return error_msg(str(e), 500)
+    if state is None:
+        return error_msg('Job not found', 404)
+    return ojson(state)
+
+# Load balancers poll /health every few seconds, so its body is built once
+HEALTH_SERVICE_NAME = 'RemindMe Notification API with Scheduler and AI'
+_HEALTH_BODY = orjson.dumps({'status': 'healthy', 'service': HEALTH_SERVICE_NAME})
+_HEALTH_HEADERS = {'Cache-Control': 'no-store'}
 
-@app.route('/health', methods=['GET'])
+@app.route('/health', methods=['GET', 'HEAD'])
 def health_check():
-    return jsonify({
+    if request.method == 'HEAD':
+        return Response(status=204, headers=_HEALTH_HEADERS)
+    return Response(_HEALTH_BODY, mimetype='application/json', headers=_HEALTH_HEADERS)
+
+@app.route('/health/full', methods=['GET'])
+def health_check_full():
+    return ojson({
         'status': 'healthy',
-        'timestamp': datetime.now().isoformat(),
-        'service': 'RemindMe Notification API with Scheduler and AI'
+        'timestamp': datetime.now(),
+        'service': HEALTH_SERVICE_NAME
     })
 
 @app.route('/notifications/<user_id>', methods=['GET'])
 def get_user_notifications(user_id):
+    # A malformed id would fail the whole batched uuid[] query for every coalesced request.
+    # The canonical form matches the ids the RPC returns and the cache invalidation keys.
+    try:
+        user_id = str(uuid.UUID(user_id))
+    except ValueError:
+        return error_msg('Invalid user id', 400)
+    try:
+        cached = None
+        if not redis_client:
+            with notifications_cache_lock:
+                cached = notifications_cache.get(user_id)
+        if cached is None:
+            body = get_shared_notifications(user_id)
+            if body is None:
+                notifications = notification_loader.load(user_id).result(timeout=2)
+                body = orjson.dumps({
+                    'status': 'success',
+                    'notifications': notifications
+                })
+                set_shared_notifications(user_id, body)
+            cached = (body, hashlib.sha1(body).hexdigest())
+            if not redis_client:
+                with notifications_cache_lock:
+                    notifications_cache[user_id] = cached
+        body, etag = cached
+        resp = not_modified(etag)
+        if resp is None:
+            resp = Response(body, mimetype='application/json')
+            resp.set_etag(etag)
+        # Let polling clients reuse the response for a few seconds without asking again
+        resp.headers['Cache-Control'] = 'private, max-age=10'
+        return resp
+    except Exception as e:
+        logger.error(f"Error fetching notifications for user {user_id}: {str(e)}")
+        return error_msg(str(e), 500)
+
+NOTIFICATIONS_STREAM_PAGE_SIZE = 1000
+
+def fetch_notifications_page(user_id, after=None):
+    # Keyset pagination on (sent_at, id), so rows logged while a stream runs do not
+    # shift the pages and cause duplicates or gaps
+    query = supabase.table('notifications_sent').select(
+        'id, event_id, notification_type, phone_number, delivery_status, sent_at'
+    ).eq('user_id', user_id)
+    if after:
+        sent_at, notification_id = after['sent_at'], after['id']
+        query = query.or_(f'sent_at.lt."{sent_at}",and(sent_at.eq."{sent_at}",id.lt."{notification_id}")')
+    return query.order('sent_at', desc=True).order('id', desc=True) \
+        .limit(NOTIFICATIONS_STREAM_PAGE_SIZE).execute().data
+
+@app.route('/notifications/<user_id>/stream', methods=['GET'])
+def stream_user_notifications(user_id):
+    # Full history as NDJSON, fetched and sent one page at a time. The first page is
+    # fetched up front so a failure still gets a proper error response.
+    try:
+        first_page = fetch_notifications_page(user_id)
+    except Exception as e:
+        logger.error(f"Error streaming notifications for user {user_id}: {str(e)}")
+        return error_msg(str(e), 500)
+    def generate():
+        page = first_page
+        sent = 0
+        try:
+            while True:
+                for row in page:
+                    yield orjson.dumps(row) + b'\n'
+                sent += len(page)
+                if len(page) < NOTIFICATIONS_STREAM_PAGE_SIZE:
+                    break
+                page = fetch_notifications_page(user_id, after=page[-1])
+        except Exception as e:
+            # Headers are already sent, so the stream can only be cut short
+            logger.error(f"Notification stream for user {user_id} aborted after {sent} row(s): {str(e)}")
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/notifications/<user_id>/<notification_id>', methods=['GET'])
+def get_user_notification(user_id, notification_id):
     try:
         response = supabase.table('notifications_sent').select(
             'id, event_id, notification_type, notification_content, phone_number, delivery_status, sent_at'
-        ).eq('user_id', user_id).order('sent_at', desc=True).limit(50).execute()
-        return jsonify({
+        ).eq('user_id', user_id).eq('id', notification_id).limit(1).execute()
+        if not response.data:
+            return error_msg('Notification not found', 404)
+        return ojson({
             'status': 'success',
-            'notifications': response.data
+            'notification': response.data[0]
         })
     except Exception as e:
-        logger.error(f"Error fetching notifications for user {user_id}: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+        logger.error(f"Error fetching notification {notification_id} for user {user_id}: {str(e)}")
+        return error_msg(str(e), 500)
+
+# --- BACKGROUND WORKERS START ---
+# Threads do not survive fork. When gunicorn preloads the app (see gunicorn.conf.py)
+# it sets DEFER_BACKGROUND_WORKERS and calls this from post_fork in each worker.
+_background_workers_pid = None
+
+def start_background_workers():
+    global _background_workers_pid
+    if _background_workers_pid == os.getpid():
+        return
+    _background_workers_pid = os.getpid()
+    start_log_listener()
+    threading.Thread(target=notification_log_writer, daemon=True, name='notification-log-writer').start()
+    twilio_rate_limiter.start()
+    scheduler_bootstrap()
+
+if os.getenv('DEFER_BACKGROUND_WORKERS') != '1':
+    start_background_workers()
 
-# --- SCHEDULER THREAD START ---
-_scheduler_started = False
 if __name__ == '__main__':
-    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
-        if not _scheduler_started:
-            scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-            scheduler_thread.start()
-            _scheduler_started = True
-            logger.info("Scheduler thread started in main process.")
-        else:
-            logger.info("Scheduler thread already started.")
+    if os.getenv('DEV'):
+        logger.info("Starting RemindMe Notification API with built-in scheduler and AI...")
+        # The reloader would import this module in a second process that competes for the scheduler
+        app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5002)
     else:
-        logger.info("Skipping scheduler thread start in reloader process.")
-    logger.info("Starting RemindMe Notification API with built-in scheduler and AI...")
-    app.run(debug=True, host='0.0.0.0', port=5002)
\ No newline at end of file
+        logger.info("Run with 'gunicorn main:app' in production, or set DEV=1 to use the Flask development server.")
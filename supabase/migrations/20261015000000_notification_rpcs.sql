@@ -0,0 +1,28 @@
+-- Events whose notification date (event_date - days_to_notify) is today and
+-- which have not been notified yet.
+create or replace function get_due_events(today date)
+returns setof events
+language sql
+stable
+as $$
+    select *
+    from events
+    where event_date - days_to_notify = today
+      and (notified is null or notified = '');
+$$;
+
+-- Marks every un-notified event whose notification date has already passed
+-- as 'No' in a single statement. Returns the number of rows updated.
+create or replace function mark_stale_events_no(today date)
+returns integer
+language sql
+as $$
+    with updated as (
+        update events
+        set notified = 'No'
+        where event_date - days_to_notify < today
+          and (notified is null or notified = '')
+        returning 1
+    )
+    select count(*)::integer from updated;
+$$;
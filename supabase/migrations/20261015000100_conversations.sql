@@ -0,0 +1,11 @@
+-- Gemini chat history, one row per message. idx gives a global ordering so the
+-- latest turns for a user can be read with the index below.
+create table if not exists conversations (
+    idx bigint generated always as identity primary key,
+    user_id uuid not null,
+    role text not null,
+    content text not null,
+    ts timestamptz not null default now()
+);
+
+create index if not exists idx_conversations_user_idx on conversations (user_id, idx desc);
@@ -0,0 +1,20 @@
+-- Pending RSVPs joined with their contacts that have not been invited yet,
+-- ordered so callers can group rows by rsvp_id.
+create or replace function pending_rsvps_with_contacts()
+returns table (
+    rsvp_id rsvp.id%type,
+    title rsvp.title%type,
+    message rsvp.message%type,
+    contact_id rsvp_contact_status.id%type,
+    phone rsvp_contact_status.contact_phone%type
+)
+language sql
+stable
+as $$
+    select r.id, r.title, r.message, c.id, c.contact_phone
+    from rsvp r
+    join rsvp_contact_status c on c.rsvp_id = r.id
+    where (r.status is null or r.status = '')
+      and (c.invite_status is null or c.invite_status = '')
+    order by r.id, c.id;
+$$;
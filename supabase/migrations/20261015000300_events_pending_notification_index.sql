@@ -0,0 +1,6 @@
+-- Covers get_due_events and mark_stale_events_no: both only look at events that
+-- have not been notified yet, keyed on their notification date. Rows already
+-- marked 'Yes' or 'No' drop out of the index and are never revisited.
+create index if not exists idx_events_pending_notification
+    on events ((event_date - days_to_notify))
+    where notified is null or notified = '';
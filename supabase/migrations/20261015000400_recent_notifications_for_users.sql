@@ -0,0 +1,28 @@
+-- The newest per_user notifications for each of the given users, in one query.
+-- Used to serve concurrent /notifications/<user_id> requests together.
+create or replace function recent_notifications_for_users(user_ids uuid[], per_user integer)
+returns table (
+    user_id notifications_sent.user_id%type,
+    id notifications_sent.id%type,
+    event_id notifications_sent.event_id%type,
+    notification_type notifications_sent.notification_type%type,
+    notification_content notifications_sent.notification_content%type,
+    phone_number notifications_sent.phone_number%type,
+    delivery_status notifications_sent.delivery_status%type,
+    sent_at notifications_sent.sent_at%type
+)
+language sql
+stable
+as $$
+    select u.user_id, n.id, n.event_id, n.notification_type, n.notification_content,
+           n.phone_number, n.delivery_status, n.sent_at
+    from unnest(user_ids) as u(user_id)
+    cross join lateral (
+        select *
+        from notifications_sent ns
+        where ns.user_id = u.user_id
+        order by ns.sent_at desc
+        limit per_user
+    ) n
+    order by u.user_id, n.sent_at desc;
+$$;
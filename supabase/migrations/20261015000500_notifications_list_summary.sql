@@ -0,0 +1,29 @@
+-- The notification list no longer returns message bodies; they are fetched per
+-- notification instead. Changing the return type requires dropping the function.
+drop function if exists recent_notifications_for_users(uuid[], integer);
+
+create function recent_notifications_for_users(user_ids uuid[], per_user integer)
+returns table (
+    user_id notifications_sent.user_id%type,
+    id notifications_sent.id%type,
+    event_id notifications_sent.event_id%type,
+    notification_type notifications_sent.notification_type%type,
+    phone_number notifications_sent.phone_number%type,
+    delivery_status notifications_sent.delivery_status%type,
+    sent_at notifications_sent.sent_at%type
+)
+language sql
+stable
+as $$
+    select u.user_id, n.id, n.event_id, n.notification_type,
+           n.phone_number, n.delivery_status, n.sent_at
+    from unnest(user_ids) as u(user_id)
+    cross join lateral (
+        select *
+        from notifications_sent ns
+        where ns.user_id = u.user_id
+        order by ns.sent_at desc
+        limit per_user
+    ) n
+    order by u.user_id, n.sent_at desc;
+$$;
@@ -0,0 +1,5 @@
+-- Lets each per-user "order by sent_at desc limit N" read straight off the index.
+-- Built without CONCURRENTLY: the Supabase CLI applies each migration file inside a
+-- transaction, where CONCURRENTLY is not allowed.
+create index if not exists idx_notifs_user_sent
+    on notifications_sent (user_id, sent_at desc);
@@ -0,0 +1,9 @@
+-- conversations holds users' private chat content. With RLS enabled and no policies
+-- the anon and authenticated roles cannot read it through PostgREST; the backend
+-- uses the service-role key, which bypasses RLS.
+alter table conversations enable row level security;
+
+-- Drop a user's chat history along with the user.
+alter table conversations
+    add constraint conversations_user_id_fkey
+    foreign key (user_id) references auth.users (id) on delete cascade;
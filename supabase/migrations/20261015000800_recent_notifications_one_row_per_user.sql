@@ -0,0 +1,34 @@
+-- PostgREST caps every response at max-rows (1000 on Supabase), set-returning RPCs
+-- included, so one row per notification truncated large batches. Return one row per
+-- user with that user's newest notifications aggregated, newest first.
+drop function if exists recent_notifications_for_users(uuid[], integer);
+
+create function recent_notifications_for_users(user_ids uuid[], per_user integer)
+returns table (
+    user_id uuid,
+    notifications json
+)
+language sql
+stable
+as $$
+    select u.user_id,
+           coalesce(
+               (select json_agg(json_build_object(
+                           'id', n.id,
+                           'event_id', n.event_id,
+                           'notification_type', n.notification_type,
+                           'phone_number', n.phone_number,
+                           'delivery_status', n.delivery_status,
+                           'sent_at', n.sent_at
+                       ) order by n.sent_at desc)
+                from (
+                    select *
+                    from notifications_sent ns
+                    where ns.user_id = u.user_id
+                    order by ns.sent_at desc
+                    limit per_user
+                ) n),
+               '[]'::json
+           )
+    from unnest(user_ids) as u(user_id);
+$$;
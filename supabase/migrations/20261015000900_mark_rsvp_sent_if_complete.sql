@@ -0,0 +1,22 @@
+-- Marks an RSVP 'sent' only once none of its contacts are left uninvited. The poller
+-- cannot tell that from pending_rsvps_with_contacts alone, whose response PostgREST
+-- may have cut short at max-rows. Returns whether the RSVP was marked.
+create or replace function mark_rsvp_sent_if_complete(p_rsvp_id rsvp.id%type)
+returns boolean
+language sql
+volatile
+as $$
+    with marked as (
+        update rsvp r
+        set status = 'sent'
+        where r.id = p_rsvp_id
+          and not exists (
+              select 1
+              from rsvp_contact_status c
+              where c.rsvp_id = r.id
+                and (c.invite_status is null or c.invite_status = '')
+          )
+        returning r.id
+    )
+    select exists (select 1 from marked);
+$$;
@@ -0,0 +1,13 @@
+-- State of queued /test-notification sends, so any worker can answer the job poll
+-- when Redis is not configured. Rows older than an hour are ignored and purged by
+-- the backend.
+create table if not exists test_notification_jobs (
+    job_id text primary key,
+    state jsonb not null,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists idx_test_notification_jobs_created_at on test_notification_jobs (created_at);
+
+-- Only the backend (service-role key) reads or writes job state.
+alter table test_notification_jobs enable row level security;